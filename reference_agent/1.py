@@ -1,8 +1,17 @@
 import os
+import re
+import atexit
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+from itertools import chain
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import gradio as gr
 from pathlib import Path
 import tempfile
-from collections import Counter
 from docx import Document
 import fitz
 from dotenv import load_dotenv
@@ -10,50 +19,114 @@ from zhipuai import ZhipuAI
 from utils import (
     get_reference_titles,
     get_citation_markers,
-    search_from_arxiv,
+    search_titles_from_arxiv,
     get_arxiv_metadata_only,
     batch_verify_citations_lightweight,
     load_pdf,
-    load_prompt
+    load_prompt,
+    score_title_candidates,
+    TITLE_SIMILARITY_THRESHOLD,
+    VERIFY_CHUNK_SIZE,
+    count_citations,
+    file_digest
 )
-from difflib import SequenceMatcher
 import time
 
 # 加载环境变量
 load_dotenv()
 
+UI_UPDATE_INTERVAL = 0.25  # 界面刷新的最小间隔(秒)
+DOCUMENT_CACHE_SIZE = 8  # 按文件内容缓存的文档解析结果数量
+ARXIV_FOUND_HEADER = "📚 arXiv找到的文献："
+ARXIV_NOT_FOUND_HEADER = "❌ arXiv未找到的文献："
 
-def clean_title_for_comparison(title):
-    """清理标题用于比较，去除标点符号、转换为小写等"""
-    import re
-    cleaned = re.sub(r'[^\w\s]', ' ', title.lower())
-    cleaned = re.sub(r'\s+', ' ', cleaned).strip()
-    return cleaned
-
-
-def is_similar(title1, title2, threshold=0.8):
-    """改进的相似性比较函数"""
-    similarity1 = SequenceMatcher(None, title1.lower(), title2.lower()).ratio()
-    clean_title1 = clean_title_for_comparison(title1)
-    clean_title2 = clean_title_for_comparison(title2)
-    similarity2 = SequenceMatcher(None, clean_title1, clean_title2).ratio()
-    words1 = set(clean_title1.split())
-    words2 = set(clean_title2.split())
-    if len(words1) > 0 and len(words2) > 0:
-        word_overlap = len(words1.intersection(words2)) / len(words1.union(words2))
-    else:
-        word_overlap = 0
-    max_similarity = max(similarity1, similarity2, word_overlap)
-    return max_similarity > threshold, max_similarity
 
 
-def load_document(file_path):
-    """支持加载word/pdf文档"""
+@dataclass(slots=True)
+class ArxivFound:
+    """在arXiv中找到匹配的参考文献"""
+    index: int
+    title: str
+    arxiv_title: str
+    similarity: float
+    authors: tuple
+    abstract: str
+
+
+@dataclass(slots=True)
+class ArxivNotFound:
+    """在arXiv中未找到匹配的参考文献"""
+    index: int
+    title: str
+    error: Optional[str] = None
+
+
+# 参考文献章节标题，需独占一行
+_REF_HEADING_RE = re.compile(r'^\s*(?:\d+\.?\s*)?(?:references?|bibliography|参考文献)\s*$',
+                             re.IGNORECASE | re.MULTILINE)
+
+
+_document_cache = {}  # 文件内容摘要 -> (正文, 参考文献)
+_document_cache_lock = threading.Lock()  # Gradio在多个线程中处理请求，读写缓存需加锁
+
+
+def load_document_split(file_path):
+    """加载文档并拆分为(正文, 参考文献)，相同内容的文件只解析一次"""
+    key = file_digest(file_path) + Path(file_path).suffix
+    with _document_cache_lock:
+        cached = _document_cache.get(key)
+    if cached is not None:
+        return cached
+    # PyMuPDF解析期间持有GIL，放到子进程中执行以免阻塞其他请求；解析时不持有锁
+    try:
+        result = _get_process_pool().submit(_split_document, file_path).result()
+    except BrokenProcessPool:
+        # 子进程崩溃(如MuPDF处理损坏的文件)后进程池不可再用，重建进程池后重试一次
+        _get_process_pool.cache_clear()
+        try:
+            result = _get_process_pool().submit(_split_document, file_path).result()
+        except BrokenProcessPool:
+            # 仍然崩溃说明是文件本身的问题，丢弃进程池以免影响之后的上传
+            _get_process_pool.cache_clear()
+            raise
+    with _document_cache_lock:
+        if key not in _document_cache and len(_document_cache) >= DOCUMENT_CACHE_SIZE:
+            # 淘汰最早缓存的文档
+            _document_cache.pop(next(iter(_document_cache)))
+        _document_cache[key] = result
+    return result
+
+
+@lru_cache(maxsize=1)
+def _get_process_pool():
+    return ProcessPoolExecutor(max_workers=2)
+
+
+def _split_document(file_path):
+    """加载文档并拆分为(正文, 参考文献)，找不到参考文献章节时两部分均为全文"""
     if file_path.endswith('.pdf'):
         with fitz.open(file_path) as doc:
-            return "\n".join([page.get_text() for page in doc])
-    else:
-        return "\n".join([p.text for p in Document(file_path).paragraphs if p.text])
+            # 参考文献通常位于文末，从后往前找到章节标题即停止
+            ref_pages = deque()
+            for page_no in range(len(doc) - 1, -1, -1):
+                text = doc[page_no].get_text()
+                headings = list(_REF_HEADING_RE.finditer(text))
+                if headings:
+                    split_at = headings[-1].start()
+                    ref_pages.appendleft(text[split_at:])
+                    body_pages = [doc[i].get_text() for i in range(page_no)]
+                    body_pages.append(text[:split_at])
+                    return "\n".join(body_pages), "\n".join(ref_pages)
+                ref_pages.appendleft(text)
+        full_text = "\n".join(ref_pages)
+        return full_text, full_text
+
+    paragraphs = [p.text for p in Document(file_path).paragraphs if p.text]
+    for i in range(len(paragraphs) - 1, -1, -1):
+        if _REF_HEADING_RE.match(paragraphs[i]):
+            return "\n".join(paragraphs[:i]), "\n".join(paragraphs[i:])
+    full_text = "\n".join(paragraphs)
+    return full_text, full_text
 
 
 def verify_citations_and_analyze_with_logs(file_path, lightweight_mode, skip_download, pdf_verify):
@@ -76,40 +149,47 @@ def verify_citations_and_analyze_with_logs(file_path, lightweight_mode, skip_dow
     try:
         yield add_log("🚀 开始文献检查分析..."), "", "", "", "", "分析中..."
         add_log(f"📖 正在加载文档: {Path(file_path).name}")
-        doc_content = load_document(file_path)
+        doc_content, ref_content = load_document_split(file_path)
         results['doc_content'] = doc_content
-        add_log(f"✅ 文档加载完成，共 {len(doc_content)} 个字符")
+        if ref_content is doc_content:
+            add_log(f"✅ 文档加载完成，共 {len(doc_content)} 个字符 (未识别到参考文献章节)")
+        else:
+            add_log(f"✅ 文档加载完成，正文 {len(doc_content)} 个字符，参考文献 {len(ref_content)} 个字符")
         yield add_log(""), "", "", "", "", "分析中..."
 
         add_log("🔍 正在提取参考文献标题...")
-        titles = get_reference_titles(doc_content)
+        titles = get_reference_titles(ref_content)
         results['titles'] = titles
         add_log(f"📚 提取到 {len(titles)} 篇参考文献")
         yield add_log(""), "", "", "", "", "分析中..."
 
         add_log("📊 正在分析引文标记...")
-        citations_to_text = get_citation_markers(doc_content)
+        citations_to_text = get_citation_markers(doc_content, len(titles))
         add_log(f"🔖 找到 {len(citations_to_text)} 个引用标记")
 
         citations = []
         for citation, citation_text in citations_to_text:
             citations.extend(citation)
 
-        missed_citations = list(set(range(1, len(titles) + 1)) - set(citations))
-        counter = Counter(citations)
-        duplicate_citations = [citation for citation, count in counter.items() if count > 1]
+        # 一次计数同时得到未引用和重复引用的文献
+        counts, out_of_range = count_citations(citations, len(titles))
+        missed_citations = [citation for citation in range(1, len(titles) + 1) if not counts[citation]]
+        duplicates = {citation: count for citation, count in enumerate(counts) if count > 1}
+        duplicates.update((citation, count) for citation, count in sorted(out_of_range.items()) if count > 1)
+        duplicate_citations = list(duplicates)
+        unique_citations = sum(1 for count in counts if count) + len(out_of_range)
 
         results['citations_info'] = {
             'total_references': len(titles),
             'total_citations': len(citations_to_text),
-            'unique_citations': len(set(citations)),
+            'unique_citations': unique_citations,
             'missed_citations': missed_citations,
             'duplicate_citations': duplicate_citations,
-            'citation_details': [(citation, count) for citation, count in counter.items() if count > 1]
+            'citation_details': list(duplicates.items())
         }
 
         add_log(f"📈 引文统计完成:")
-        add_log(f"   - 总引用数: {len(set(citations))} 个")
+        add_log(f"   - 总引用数: {unique_citations} 个")
         add_log(f"   - 未引用文献: {len(missed_citations)} 篇")
         add_log(f"   - 重复引用: {len(duplicate_citations)} 篇")
 
@@ -119,61 +199,69 @@ def verify_citations_and_analyze_with_logs(file_path, lightweight_mode, skip_dow
         add_log("🌐 开始在arXiv中搜索文献...")
         arxiv_found = []
         arxiv_not_found = []
+        # 搜索过程中增量追加格式化文本，避免每次刷新都重新格式化全部结果
+        found_lines = [ARXIV_FOUND_HEADER]
+        not_found_lines = [ARXIV_NOT_FOUND_HEADER]
+        last_yield = time.monotonic()
 
-        for i, title in enumerate(titles):
+        for done, (i, title, search_results, error) in enumerate(search_titles_from_arxiv(titles), 1):
             add_log(f"📄 处理文献 {i + 1}/{len(titles)}: {title[:50]}{'...' if len(title) > 50 else ''}")
-            yield add_log(""), citation_analysis, "", "", "", f"正在搜索文献 {i + 1}/{len(titles)}..."
 
             try:
-                add_log(f"🔍 在arXiv搜索: {title[:30]}...")
-                search_results = list(search_from_arxiv(title))
+                if error is not None:
+                    raise error
+
                 found_match = False
 
                 if search_results:
                     add_log(f"   📚 找到 {len(search_results)} 个搜索结果")
-                    for j, result in enumerate(search_results):
-                        add_log(f"   🔍 检查结果 {j + 1}: {result.title[:40]}...")
-                        is_match, similarity = is_similar(result.title, title)
-                        add_log(f"      相似度: {similarity:.3f}")
-
-                        if is_match:
-                            add_log(f"   ✅ 找到匹配! 相似度: {similarity:.3f}")
-                            arxiv_found.append({
-                                'index': i + 1,
-                                'title': title,
-                                'arxiv_title': result.title,
-                                'similarity': similarity,
-                                'authors': [str(author) for author in result.authors],
-                                'abstract': result.summary[:200] + "..." if len(
-                                    result.summary) > 200 else result.summary
-                            })
-                            found_match = True
-                            break
+                    similarities = score_title_candidates(title, [result['title'] for result in search_results])
+                    for j, (result, similarity) in enumerate(zip(search_results, similarities)):
+                        add_log(f"   🔍 检查结果 {j + 1}: {result['title'][:40]}...")
+                        if similarity is None:
+                            add_log(f"      长度相差过大，已预筛排除(prefiltered)")
                         else:
-                            add_log(f"      ❌ 相似度不足 (阈值: 0.8)")
+                            add_log(f"      相似度: {similarity:.3f}")
+
+                    scored = [j for j, similarity in enumerate(similarities) if similarity is not None]
+                    best = max(scored, key=similarities.__getitem__, default=None)
+                    if best is not None and similarities[best] > TITLE_SIMILARITY_THRESHOLD:
+                        result, similarity = search_results[best], similarities[best]
+                        add_log(f"   ✅ 找到匹配! 相似度: {similarity:.3f}")
+                        arxiv_found.append(ArxivFound(
+                            index=i + 1,
+                            title=title,
+                            arxiv_title=result['title'],
+                            similarity=similarity,
+                            authors=tuple(result['authors']),
+                            abstract=result['abstract'][:200] + "..." if len(
+                                result['abstract']) > 200 else result['abstract']
+                        ))
+                        found_lines.extend(format_arxiv_found_item(arxiv_found[-1]))
+                        found_match = True
+                    else:
+                        add_log(f"      ❌ 相似度不足 (阈值: {TITLE_SIMILARITY_THRESHOLD})")
 
                 if not found_match:
                     add_log(f"   ❌ 未找到匹配的文献")
-                    arxiv_not_found.append({
-                        'index': i + 1,
-                        'title': title
-                    })
+                    arxiv_not_found.append(ArxivNotFound(index=i + 1, title=title))
+                    not_found_lines.extend(format_arxiv_not_found_item(arxiv_not_found[-1]))
 
             except Exception as e:
                 add_log(f"   ❌ 搜索出错: {str(e)[:50]}...")
-                arxiv_not_found.append({
-                    'index': i + 1,
-                    'title': title,
-                    'error': str(e)
-                })
-
-            if (i + 1) % 5 == 0 or i == len(titles) - 1:
-                results['arxiv_found'] = arxiv_found
-                results['arxiv_not_found'] = arxiv_not_found
-                arxiv_found_text, arxiv_not_found_text = format_arxiv_analysis(results)
-                yield add_log(
-                    ""), citation_analysis, arxiv_found_text, arxiv_not_found_text, "", f"已处理 {i + 1}/{len(titles)} 篇文献"
-
+                arxiv_not_found.append(ArxivNotFound(index=i + 1, title=title, error=str(e)))
+                not_found_lines.extend(format_arxiv_not_found_item(arxiv_not_found[-1]))
+
+            # 界面更新节流
+            now = time.monotonic()
+            if now - last_yield >= UI_UPDATE_INTERVAL or done == len(titles):
+                last_yield = now
+                yield add_log(""), citation_analysis, "\n".join(found_lines), "\n".join(
+                    not_found_lines), "", f"已处理 {done}/{len(titles)} 篇文献"
+
+        # 并发搜索按完成顺序返回，恢复为参考文献顺序
+        arxiv_found.sort(key=lambda item: item.index)
+        arxiv_not_found.sort(key=lambda item: item.index)
         results['arxiv_found'] = arxiv_found
         results['arxiv_not_found'] = arxiv_not_found
         add_log(f"📊 arXiv搜索完成:")
@@ -185,39 +273,41 @@ def verify_citations_and_analyze_with_logs(file_path, lightweight_mode, skip_dow
             add_log("   使用轻量级模式: arXiv元数据验证")
         else:
             add_log("   使用标准模式: PDF内容验证")
-        yield add_log(""), citation_analysis, format_arxiv_analysis(results)[0], format_arxiv_analysis(results)[
-            1], "", "正在进行AI验证..."
+        arxiv_found_text, arxiv_not_found_text = format_arxiv_analysis(results)
+        yield add_log(""), citation_analysis, arxiv_found_text, arxiv_not_found_text, "", "正在进行AI验证..."
 
         add_log(f"   正在验证 {len(citations_to_text)} 个引用标记...")
         verification_results = []
 
         if lightweight_mode:
-            for i, (citation, text) in enumerate(citations_to_text):
-                add_log(f"   🔍 验证引用 {i + 1}/{len(citations_to_text)}: {citation}")
-                single_verification = batch_verify_citations_lightweight([(citation, text)], titles, "glm-4-flash")
-                verification_results.extend(single_verification)
-
-                if single_verification and single_verification[0]['status'] == 'verified':
-                    result_text = single_verification[0].get('result', '')
-                    if '<是>' in result_text:
-                        add_log(f"      ✅ 验证通过")
-                    elif '否' in result_text:
-                        reason = result_text.replace('<否:', '').replace('>', '').strip()
-                        add_log(f"      ❌ 需要检查: {reason[:50]}...")
+            for start in range(0, len(citations_to_text), VERIFY_CHUNK_SIZE):
+                chunk = citations_to_text[start:start + VERIFY_CHUNK_SIZE]
+                done = start + len(chunk)
+                add_log(f"   🔍 验证引用 {start + 1}-{done}/{len(citations_to_text)}")
+                chunk_verification = batch_verify_citations_lightweight(chunk, titles, "glm-4-flash")
+                verification_results.extend(chunk_verification)
+
+                for verification in chunk_verification:
+                    citation = verification['citation']
+                    if verification['status'] == 'verified':
+                        result_text = verification.get('result', '')
+                        if '<是>' in result_text:
+                            add_log(f"      ✅ 引用{citation}验证通过")
+                        elif '否' in result_text:
+                            reason = result_text.replace('<否:', '').replace('>', '').strip()
+                            add_log(f"      ❌ 引用{citation}需要检查: {reason[:50]}...")
+                        else:
+                            add_log(f"      ⚠️  引用{citation}结果不明确")
                     else:
-                        add_log(f"      ⚠️  结果不明确")
-                else:
-                    add_log(f"      ⏭️  跳过验证")
+                        add_log(f"      ⏭️  引用{citation}跳过验证")
 
-                if (i + 1) % 3 == 0 or i == len(citations_to_text) - 1:
-                    yield add_log(""), citation_analysis, format_arxiv_analysis(results)[0], \
-                    format_arxiv_analysis(results)[1], "", f"已验证 {i + 1}/{len(citations_to_text)} 个引用"
+                yield add_log(""), citation_analysis, arxiv_found_text, arxiv_not_found_text, "", \
+                    f"已验证 {done}/{len(citations_to_text)} 个引用"
         else:
             pass
 
         add_log("🎉 文献检查分析完成！")
-        yield add_log(""), citation_analysis, format_arxiv_analysis(results)[0], format_arxiv_analysis(results)[
-            1], "", "分析完成"
+        yield add_log(""), citation_analysis, arxiv_found_text, arxiv_not_found_text, "", "分析完成"
 
     except Exception as e:
         add_log(f"❌ 分析过程中发生错误: {str(e)[:50]}...")
@@ -250,23 +340,44 @@ def format_citation_analysis(results):
     return "\n".join(output)
 
 
+def format_arxiv_found_item(item):
+    """格式化单条arXiv找到的文献"""
+    return (
+        f"- 文献[{item.index}]: {item.title[:50]}...",
+        f"  - arXiv标题: {item.arxiv_title[:50]}...",
+        f"  - 相似度: {item.similarity:.3f}",
+        f"  - 作者: {', '.join(item.authors[:3])}{'...' if len(item.authors) > 3 else ''}",
+        f"  - 摘要: {item.abstract[:100]}...",
+    )
+
+
+def format_arxiv_not_found_item(item):
+    """格式化单条arXiv未找到的文献"""
+    if item.error is not None:
+        return (f"- 文献[{item.index}]: {item.title[:50]}...", f"  - 错误: {item.error[:50]}...")
+    return (f"- 文献[{item.index}]: {item.title[:50]}...",)
+
+
 def format_arxiv_analysis(results):
     """格式化arXiv搜索结果"""
-    found_output = ["📚 arXiv找到的文献："]
-    for item in results['arxiv_found']:
-        found_output.append(f"- 文献[{item['index']}]: {item['title'][:50]}...")
-        found_output.append(f"  - arXiv标题: {item['arxiv_title'][:50]}...")
-        found_output.append(f"  - 相似度: {item['similarity']:.3f}")
-        found_output.append(f"  - 作者: {', '.join(item['authors'][:3])}{'...' if len(item['authors']) > 3 else ''}")
-        found_output.append(f"  - 摘要: {item['abstract'][:100]}...")
+    found_output = "\n".join(chain(
+        (ARXIV_FOUND_HEADER,), *map(format_arxiv_found_item, results['arxiv_found'])))
+    not_found_output = "\n".join(chain(
+        (ARXIV_NOT_FOUND_HEADER,), *map(format_arxiv_not_found_item, results['arxiv_not_found'])))
+    return found_output, not_found_output
 
-    not_found_output = ["❌ arXiv未找到的文献："]
-    for item in results['arxiv_not_found']:
-        not_found_output.append(f"- 文献[{item['index']}]: {item['title'][:50]}...")
-        if 'error' in item:
-            not_found_output.append(f"  - 错误: {item['error'][:50]}...")
 
-    return "\n".join(found_output), "\n".join(not_found_output)
+_feedback_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _get_feedback_file():
+    """懒加载反馈文件的追加句柄，进程退出时关闭"""
+    feedback_dir = Path("feedback")
+    feedback_dir.mkdir(exist_ok=True)
+    f = open(feedback_dir / "feedback.txt", 'a', encoding='utf-8', buffering=8192)
+    atexit.register(f.close)
+    return f
 
 
 def submit_feedback(feedback):
@@ -274,14 +385,13 @@ def submit_feedback(feedback):
     if not feedback.strip():
         return "⚠️ 反馈内容不能为空！"
 
-    feedback_dir = Path("feedback")
-    feedback_dir.mkdir(exist_ok=True)
-    feedback_file = feedback_dir / "feedback.txt"
-
     try:
-        with open(feedback_file, 'a', encoding='utf-8') as f:
-            timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+        with _feedback_lock:
+            f = _get_feedback_file()
             f.write(f"[{timestamp}] {feedback}\n")
+            # 只刷新到操作系统，不做fsync
+            f.flush()
         return "✅ 感谢您的反馈！已成功保存。"
     except Exception as e:
         return f"❌ 保存反馈失败: {str(e)[:50]}..."
@@ -324,4 +434,6 @@ with gr.Blocks() as demo:
         outputs=feedback_result
     )
 
-demo.launch()
\ No newline at end of file
+if __name__ == "__main__":
+    # 文档解析使用进程池，子进程会重新导入本模块，启动界面需放在主模块保护内
+    demo.launch()
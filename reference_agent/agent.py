@@ -1,12 +1,10 @@
-import os
+import io
 from pathlib import Path
 import argparse
-from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from docx import Document
 from dotenv import load_dotenv
-from zhipuai import ZhipuAI
 import fitz
-import re
 import logging
 from utils import (
     load_prompt,
@@ -14,10 +12,14 @@ from utils import (
     get_reference_titles,
     get_citation_markers,
     load_pdf,
-    search_from_arxiv,
-    batch_verify_citations_lightweight
+    search_titles_from_arxiv,
+    download_arxiv_pdf,
+    batch_verify_citations_lightweight,
+    score_title_candidates,
+    TITLE_SIMILARITY_THRESHOLD,
+    count_citations,
+    get_zhipu_client
 )
-from difflib import SequenceMatcher
 import time
 
 # 设置日志
@@ -27,7 +29,7 @@ def safe_download(result, title, i, max_retries=3):
     for attempt in range(max_retries):
         try:
             print(f"尝试下载: {title} (第 {attempt+1} 次)")
-            result.download_pdf(dirpath="../data/references", filename=f"{i+1}.pdf")
+            download_arxiv_pdf(result, dirpath="../data/references", filename=f"{i+1}.pdf")
             print(f"✅ 下载成功: {title}")
             return True
         except Exception as e:
@@ -37,43 +39,9 @@ def safe_download(result, title, i, max_retries=3):
     return False  # 明确表示失败
 
 
-def clean_title_for_comparison(title):
-    """清理标题用于比较，去除标点符号、转换为小写等"""
-    # 去除常见的标点符号和特殊字符
-    cleaned = re.sub(r'[^\w\s]', ' ', title.lower())
-    # 去除多余空格
-    cleaned = re.sub(r'\s+', ' ', cleaned).strip()
-    return cleaned
-
-
-def is_similar(title1, title2, threshold=0.8):
-    """改进的相似性比较函数"""
-    # 原始标题比较
-    similarity1 = SequenceMatcher(None, title1.lower(), title2.lower()).ratio()
-    
-    # 清理后的标题比较
-    clean_title1 = clean_title_for_comparison(title1)
-    clean_title2 = clean_title_for_comparison(title2)
-    similarity2 = SequenceMatcher(None, clean_title1, clean_title2).ratio()
-    
-    # 关键词匹配
-    words1 = set(clean_title1.split())
-    words2 = set(clean_title2.split())
-    if len(words1) > 0 and len(words2) > 0:
-        word_overlap = len(words1.intersection(words2)) / len(words1.union(words2))
-    else:
-        word_overlap = 0
-    
-    # 综合评分（取最高分）
-    max_similarity = max(similarity1, similarity2, word_overlap)
-    
-    print(f"    📊 相似度分析:")
-    print(f"       原始: {similarity1:.3f}")
-    print(f"       清理: {similarity2:.3f}")
-    print(f"       词汇: {word_overlap:.3f}")
-    print(f"       最终: {max_similarity:.3f} (阈值: {threshold})")
-    
-    return max_similarity > threshold
+def download_first_match(matches, title, i):
+    """按相似度顺序尝试下载匹配结果，任一成功即返回True"""
+    return any(safe_download(result, title, i) for result in matches)
 
 
 class Agent:
@@ -82,18 +50,24 @@ class Agent:
         self.prompt = load_prompt(prompt)
         self.doc = self._load_document(doc)  # 修改为统一加载方法
         self.ref = ref
+        self.client = get_zhipu_client()
 
     def _load_document(self, doc_path):
         """支持加载word/pdf文档"""
         if doc_path.endswith('.pdf'):
+            # 逐页写入缓冲区，避免同时持有所有页面文本的列表
+            buf = io.StringIO()
             with fitz.open(doc_path) as doc:
-                return "\n".join([page.get_text() for page in doc])
+                for i, page in enumerate(doc):
+                    if i:
+                        buf.write("\n")
+                    buf.write(page.get_text())
+            return buf.getvalue()
         else:
             return "\n".join([p.text for p in Document(doc_path).paragraphs if p.text])
 
     def call_model(self, model, prompt):
-        client = ZhipuAI(api_key=os.environ.get("ZHIPUAI_API_KEY"))
-        response = client.chat.completions.create(
+        response = self.client.chat.completions.create(
             model=model,
             messages=[{"role": "user", "content": prompt}],
             temperature=0,
@@ -107,7 +81,7 @@ class Agent:
         print(f"文献列表共有{len(titles)}篇参考文献")
 
         citations = []
-        citations_to_text = get_citation_markers(self.doc)
+        citations_to_text = get_citation_markers(self.doc, len(titles))
         print(f"提取到{len(citations_to_text)}个引用标记")
         
         for i, (citation, citation_text) in enumerate(citations_to_text):
@@ -116,17 +90,18 @@ class Agent:
 
         print(f"总共找到{len(citations)}个引用编号: {sorted(set(citations))}")
         
-        missed_citations = list(set(range(1, len(titles)+1)) - set(citations))
+        # 一次计数同时得到未引用和重复引用的文献
+        counts, out_of_range = count_citations(citations, len(titles))
+        missed_citations = [citation for citation in range(1, len(titles)+1) if not counts[citation]]
         if missed_citations:
             print(f"以下{len(missed_citations)}个文献没有被引用:")
-            for citation in sorted(missed_citations):
+            for citation in missed_citations:
                 print(f"文献[{citation}]没有被引用")
         else:
             print("所有文献都被引用了 ✅")
 
-        counter = Counter(citations)
         duplicate_count = 0
-        for citation, count in counter.items():
+        for citation, count in [*enumerate(counts), *sorted(out_of_range.items())]:
             if count > 1:
                 duplicate_count += 1
                 print(f"文献[{citation}]的引用超过1次,共引用了{count}次")
@@ -144,53 +119,66 @@ class Agent:
         download_dir = Path("../data/references")
         download_dir.mkdir(parents=True, exist_ok=True)
 
+        pending = []
         for i, title in enumerate(titles):
             pdf_filename = f"{i+1}.pdf"
             pdf_path = download_dir / pdf_filename
             
-            print(f"\n📄 处理文献 {i+1}/{len(titles)}: {title}")
-            
             # 检查文件是否已经存在
             if pdf_path.exists():
-                print(f"⏭️  跳过已存在的文献 (文件: {pdf_filename})")
+                print(f"⏭️  跳过已存在的文献 {i+1}/{len(titles)} (文件: {pdf_filename})")
                 skipped_titles.append(title)
                 continue
-            
-            found = False
-            print(f"🔍 在arXiv搜索: {title}")
-            
-            try:
-                search_results = list(search_from_arxiv(title))
-                print(f"   📚 找到 {len(search_results)} 个搜索结果")
-                
-                if not search_results:
-                    print(f"❌ arXiv上无搜索结果")
-                    failed_titles.append(title)
-                    continue
-                
-                # 遍历搜索结果寻找最佳匹配
-                best_match = None
-                best_similarity = 0
+            pending.append((i, title))
+
+        print(f"🔍 在arXiv并发搜索 {len(pending)} 篇文献...")
+        # 下载是I/O密集型任务，搜索结果一到就提交到下载线程池
+        with ThreadPoolExecutor(max_workers=6) as download_pool:
+            downloads = {}
+            for k, _, search_results, error in search_titles_from_arxiv([title for _, title in pending]):
+                i, title = pending[k]
+                print(f"\n📄 处理文献 {i+1}/{len(titles)}: {title}")
                 
-                for j, result in enumerate(search_results):
-                    print(f"   🔍 检查结果 {j+1}: {result.title}")
+                try:
+                    if error is not None:
+                        raise error
+
+                    print(f"   📚 找到 {len(search_results)} 个搜索结果")
+                    
+                    if not search_results:
+                        print(f"❌ arXiv上无搜索结果")
+                        failed_titles.append(title)
+                        continue
                     
-                    if is_similar(result.title, title):
-                        found = True
-                        print(f"   ✅ 找到匹配!")
-                        success = safe_download(result, title, i)
-                        if success:
-                            break
+                    # 批量计算所有搜索结果的相似度，按相似度从高到低尝试下载
+                    similarities = score_title_candidates(title, [result['title'] for result in search_results])
+                    for j, (result, similarity) in enumerate(zip(search_results, similarities)):
+                        print(f"   🔍 检查结果 {j+1}: {result['title']}")
+                        if similarity is None:
+                            print(f"    📊 长度相差过大，已预筛排除(prefiltered)")
                         else:
-                            found = False
-                            
-                if not found:
-                    print(f"❌ 未找到足够相似的文献")
+                            print(f"    📊 相似度: {similarity:.3f} (阈值: {TITLE_SIMILARITY_THRESHOLD})")
+
+                    ranked = sorted(
+                        ((similarity, j) for j, similarity in enumerate(similarities) if similarity is not None),
+                        reverse=True
+                    )
+                    matches = [search_results[j] for similarity, j in ranked if similarity > TITLE_SIMILARITY_THRESHOLD]
+                    if not matches:
+                        print(f"❌ 未找到足够相似的文献")
+                        failed_titles.append(title)
+                        continue
+
+                    print(f"   ✅ 找到匹配! 相似度: {ranked[0][0]:.3f}")
+                    downloads[download_pool.submit(download_first_match, matches, title, i)] = title
+                        
+                except Exception as e:
+                    print(f"❌ 搜索过程出错: {str(e)}")
                     failed_titles.append(title)
-                    
-            except Exception as e:
-                print(f"❌ 搜索过程出错: {str(e)}")
-                failed_titles.append(title)
+
+            for future in as_completed(downloads):
+                if not future.result():
+                    failed_titles.append(downloads[future])
 
         print("\n" + "="*60)
         print("📊 下载统计:")
@@ -306,7 +294,7 @@ class Agent:
         print("第3步(轻量版): 使用arXiv元数据验证引文")
         
         titles = get_reference_titles(self.doc)
-        citations_to_text = get_citation_markers(self.doc)
+        citations_to_text = get_citation_markers(self.doc, len(titles))
         
         print(f"参考文献数量: {len(titles)}")
         print(f"引用标记数量: {len(citations_to_text)}")
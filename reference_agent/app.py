@@ -1,61 +1,119 @@
 import os
+import io
+import re
+import threading
+from queue import Queue
 import gradio as gr
 from pathlib import Path
 import tempfile
-from collections import Counter
+from collections import Counter, deque
 from docx import Document
 import fitz
 from dotenv import load_dotenv
-from zhipuai import ZhipuAI
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from utils import (
     get_reference_titles,
     get_citation_markers,
-    search_from_arxiv,
+    search_titles_from_arxiv,
     get_arxiv_metadata_only,
     batch_verify_citations_lightweight,
     load_pdf,
-    load_prompt
+    load_prompt,
+    cache_get,
+    cache_set,
+    cache_prune,
+    file_digest,
+    get_zhipu_client,
+    VERIFY_CHUNK_SIZE,
+    TITLE_SIMILARITY_THRESHOLD,
+    prepare_title,
+    score_candidates,
+    PDF_TEXT_FLAGS
 )
-from difflib import SequenceMatcher
 import time
 
 # 加载环境变量
 load_dotenv()
 
-def clean_title_for_comparison(title):
-    """清理标题用于比较，去除标点符号、转换为小写等"""
-    import re
-    cleaned = re.sub(r'[^\w\s]', ' ', title.lower())
-    cleaned = re.sub(r'\s+', ' ', cleaned).strip()
-    return cleaned
+LOG_MAX_LINES = 500  # 实时日志保留的最大行数
+DOCUMENT_CACHE_TTL = 30 * 86400  # 文档解析结果缓存30天
 
-def is_similar(title1, title2, threshold=0.8):
-    """改进的相似性比较函数"""
-    similarity1 = SequenceMatcher(None, title1.lower(), title2.lower()).ratio()
-    
-    clean_title1 = clean_title_for_comparison(title1)
-    clean_title2 = clean_title_for_comparison(title2)
-    similarity2 = SequenceMatcher(None, clean_title1, clean_title2).ratio()
-    
-    words1 = set(clean_title1.split())
-    words2 = set(clean_title2.split())
-    if len(words1) > 0 and len(words2) > 0:
-        word_overlap = len(words1.intersection(words2)) / len(words1.union(words2))
-    else:
-        word_overlap = 0
-    
-    max_similarity = max(similarity1, similarity2, word_overlap)
-    return max_similarity > threshold, max_similarity
+# 模型验证结果的标记：<是> 或 <否: 理由>
+_YES_TOKEN = '<是>'
+_NO_RE = re.compile(r'<否[:：]?\s*([^>]*)>')
+
+def truncate(text, length):
+    """截断过长的文本，超出部分以...表示"""
+    return text if len(text) <= length else text[:length] + "..."
+
+def extract_no_reason(result):
+    """从模型返回的<否: 理由>中提取理由，格式不符时返回原文"""
+    match = _NO_RE.search(result)
+    return match.group(1).strip() if match else result.strip()
 
 def load_document(file_path):
     """支持加载word/pdf文档"""
+    # 逐段写入缓冲区，避免同时持有所有页面/段落文本的列表
+    buf = io.StringIO()
     if file_path.endswith('.pdf'):
         with fitz.open(file_path) as doc:
-            return "\n".join([page.get_text() for page in doc])
+            _write_lines(buf, (page.get_text("text", flags=PDF_TEXT_FLAGS) for page in doc))
     else:
-        return "\n".join([p.text for p in Document(file_path).paragraphs if p.text])
+        _write_lines(buf, (p.text for p in Document(file_path).paragraphs if p.text))
+    return buf.getvalue()
+
+def _write_lines(buf, texts):
+    """将文本逐个写入缓冲区，以换行分隔"""
+    for i, text in enumerate(texts):
+        if i:
+            buf.write("\n")
+        buf.write(text)
+
+def prefetch(iterable):
+    """在后台线程中提前消费迭代器，返回按原顺序读取结果的生成器"""
+    queue = Queue()
+    done = object()
+    
+    def worker():
+        try:
+            for item in iterable:
+                queue.put((item, None))
+        except Exception as e:
+            queue.put((None, e))
+        finally:
+            queue.put((done, None))
+    
+    threading.Thread(target=worker, daemon=True).start()
+    
+    def consume():
+        while True:
+            item, error = queue.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    
+    return consume()
+
+def verify_lightweight_in_chunks(citations_to_text, titles, model="glm-4-flash"):
+    """按批使用arXiv元数据验证引用，逐批返回(起始序号, 结束序号, 验证结果)"""
+    for start in range(0, len(citations_to_text), VERIFY_CHUNK_SIZE):
+        chunk = citations_to_text[start:start + VERIFY_CHUNK_SIZE]
+        yield start, start + len(chunk), batch_verify_citations_lightweight(chunk, titles, model)
+
+def verify_with_references(prompt_template, text, references, model="glm-4-flash"):
+    """使用参考文献PDF内容验证单条引用，返回模型的判断结果"""
+    prompt = prompt_template.format(text, references)
+    
+    response = get_zhipu_client().chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0
+    )
+    return response.choices[0].message.content
 
-def verify_citations_and_analyze_with_logs(file_path, lightweight_mode, skip_download, pdf_verify):
+def verify_citations_and_analyze_with_logs(file_path, lightweight_mode, skip_download, pdf_verify, force_refresh=False):
     """主要的文献检查函数，整合所有功能，带实时日志"""
     
     # 存储结果的字典
@@ -68,97 +126,131 @@ def verify_citations_and_analyze_with_logs(file_path, lightweight_mode, skip_dow
         'verification_results': []
     }
     
-    log_messages = []
+    # 只保留最近的日志，界面上只显示末尾部分
+    log_messages = deque(maxlen=LOG_MAX_LINES)
     
     def add_log(message):
         """添加日志消息"""
         log_messages.append(f"[{time.strftime('%H:%M:%S')}] {message}")
+    
+    def render_logs():
+        """拼接日志文本，只在刷新界面时调用"""
         return "\n".join(log_messages)
     
     try:
         # 初始化日志
-        yield add_log("🚀 开始文献检查分析..."), "", "", "", "", "分析中..."
+        add_log("🚀 开始文献检查分析...")
+        yield render_logs(), "", "", "", "", "分析中..."
+        
+        # 按文件内容哈希缓存解析出的文本，相同文档无需重复解析；
+        # 标题和引用标记的模型提取结果由utils中带版本号的缓存负责，提取失败时不会写入缓存
+        # 键中带上文本提取参数，修改提取方式后旧的解析结果自动失效
+        doc_key = f"{PDF_TEXT_FLAGS}:{file_digest(file_path)}"
+        doc_content = None if force_refresh else cache_get("document_text", doc_key, max_age=DOCUMENT_CACHE_TTL)
         
         # 1. 加载文档
         add_log(f"📖 正在加载文档: {Path(file_path).name}")
-        doc_content = load_document(file_path)
+        if doc_content is not None:
+            add_log("♻️ 使用缓存的文档解析结果")
+        else:
+            doc_content = load_document(file_path)
+            cache_set("document_text", doc_key, doc_content)
+            cache_prune("document_text", DOCUMENT_CACHE_TTL)
         results['doc_content'] = doc_content
         add_log(f"✅ 文档加载完成，共 {len(doc_content)} 个字符")
-        yield add_log(""), "", "", "", "", "分析中..."
+        yield render_logs(), "", "", "", "", "分析中..."
         
         # 2. 提取参考文献标题
         add_log("🔍 正在提取参考文献标题...")
         titles = get_reference_titles(doc_content)
         results['titles'] = titles
         add_log(f"📚 提取到 {len(titles)} 篇参考文献")
-        yield add_log(""), "", "", "", "", "分析中..."
+        # arXiv搜索只依赖标题，提前在后台开始，与引文分析同时进行
+        arxiv_search = prefetch(search_titles_from_arxiv(titles))
+        yield render_logs(), "", "", "", "", "分析中..."
         
         # 3. 分析引文数量和引用情况
         add_log("📊 正在分析引文标记...")
-        citations_to_text = get_citation_markers(doc_content)
+        citations_to_text = get_citation_markers(doc_content, len(titles))
         add_log(f"🔖 找到 {len(citations_to_text)} 个引用标记")
         
+        # 轻量级验证只依赖引用标记和标题，提前在后台开始，与arXiv搜索同时进行
+        if lightweight_mode:
+            lightweight_verification = prefetch(verify_lightweight_in_chunks(citations_to_text, titles))
+        
         citations = []
         for citation, citation_text in citations_to_text:
             citations.extend(citation)
         
-        # 统计未被引用的文献
-        missed_citations = list(set(range(1, len(titles)+1)) - set(citations))
+        # 统计未被引用的文献，用位图标记被引用的编号
+        cited = bytearray(len(titles) + 1)
+        for citation in citations:
+            if 0 < citation <= len(titles):
+                cited[citation] = 1
+        missed_citations = [i for i in range(1, len(titles) + 1) if not cited[i]]
         
-        # 统计重复引用
+        # 统计重复引用，一次遍历计数结果同时得到编号和次数
         counter = Counter(citations)
-        duplicate_citations = [citation for citation, count in counter.items() if count > 1]
+        duplicates = {citation: count for citation, count in counter.items() if count > 1}
+        duplicate_citations = list(duplicates)
         
         results['citations_info'] = {
             'total_references': len(titles),
             'total_citations': len(citations_to_text),
-            'unique_citations': len(set(citations)),
+            'unique_citations': len(counter),
             'missed_citations': missed_citations,
             'duplicate_citations': duplicate_citations,
-            'citation_details': [(citation, count) for citation, count in counter.items() if count > 1]
+            'citation_details': list(duplicates.items())
         }
         
         # 日志输出统计结果
         add_log(f"📈 引文统计完成:")
-        add_log(f"   - 总引用数: {len(set(citations))} 个")
+        add_log(f"   - 总引用数: {len(counter)} 个")
         add_log(f"   - 未引用文献: {len(missed_citations)} 篇")
         add_log(f"   - 重复引用: {len(duplicate_citations)} 篇")
         
         # 输出引文分析结果
         citation_analysis = format_citation_analysis(results)
-        yield add_log(""), citation_analysis, "", "", "", "分析中..."
+        yield render_logs(), citation_analysis, "", "", "", "分析中..."
         
         # 4. 在arXiv中搜索文献
         add_log("🌐 开始在arXiv中搜索文献...")
         arxiv_found = []
         arxiv_not_found = []
         
-        for i, title in enumerate(titles):
-            add_log(f"📄 处理文献 {i+1}/{len(titles)}: {title[:50]}{'...' if len(title) > 50 else ''}")
-            yield add_log(""), citation_analysis, "", "", "", f"正在搜索文献 {i+1}/{len(titles)}..."
+        # 按完成顺序处理后台并发搜索的结果
+        for done, (i, title, search_results, error) in enumerate(arxiv_search, 1):
+            add_log(f"📄 处理文献 {i+1}/{len(titles)}: {truncate(title, 50)}")
+            yield render_logs(), citation_analysis, "", "", "", f"正在搜索文献 {done}/{len(titles)}..."
             
             try:
-                add_log(f"🔍 在arXiv搜索: {title[:30]}...")
-                search_results = list(search_from_arxiv(title))
+                if error is not None:
+                    raise error
+                
+                # 参考文献标题只需清理一次，与每个搜索结果比较时复用
+                prepared_title = prepare_title(title)
                 found_match = False
                 
                 if search_results:
                     add_log(f"   📚 找到 {len(search_results)} 个搜索结果")
                     
-                    for j, result in enumerate(search_results):
-                        add_log(f"   🔍 检查结果 {j+1}: {result.title[:40]}...")
-                        is_match, similarity = is_similar(result.title, title)
+                    similarities = score_candidates(prepared_title, [result['title'] for result in search_results])
+                    for j, (result, similarity) in enumerate(zip(search_results, similarities)):
+                        add_log(f"   🔍 检查结果 {j+1}: {truncate(result['title'], 40)}")
+                        if similarity is None:
+                            add_log(f"      长度相差过大，已预筛排除(prefiltered)")
+                            continue
                         add_log(f"      相似度: {similarity:.3f}")
                         
-                        if is_match:
+                        if similarity > TITLE_SIMILARITY_THRESHOLD:
                             add_log(f"   ✅ 找到匹配! 相似度: {similarity:.3f}")
                             arxiv_found.append({
                                 'index': i + 1,
                                 'title': title,
-                                'arxiv_title': result.title,
+                                'arxiv_title': result['title'],
                                 'similarity': similarity,
-                                'authors': [str(author) for author in result.authors],
-                                'abstract': result.summary[:200] + "..." if len(result.summary) > 200 else result.summary
+                                'authors': result['authors'],
+                                'abstract': truncate(result['abstract'], 200)
                             })
                             found_match = True
                             break
@@ -181,14 +273,19 @@ def verify_citations_and_analyze_with_logs(file_path, lightweight_mode, skip_dow
                 })
             
             # 每处理5篇文献更新一次界面
-            if (i + 1) % 5 == 0 or i == len(titles) - 1:
+            if done % 5 == 0 or done == len(titles):
                 results['arxiv_found'] = arxiv_found
                 results['arxiv_not_found'] = arxiv_not_found
                 arxiv_found_text, arxiv_not_found_text = format_arxiv_analysis(results)
-                yield add_log(""), citation_analysis, arxiv_found_text, arxiv_not_found_text, "", f"已处理 {i+1}/{len(titles)} 篇文献"
+                yield render_logs(), citation_analysis, arxiv_found_text, arxiv_not_found_text, "", f"已处理 {done}/{len(titles)} 篇文献"
         
+        # 并发搜索按完成顺序返回，恢复为参考文献顺序
+        arxiv_found.sort(key=lambda item: item['index'])
+        arxiv_not_found.sort(key=lambda item: item['index'])
         results['arxiv_found'] = arxiv_found
         results['arxiv_not_found'] = arxiv_not_found
+        # 搜索完成后arXiv结果不再变化，只格式化一次供后续刷新复用
+        arxiv_found_text, arxiv_not_found_text = format_arxiv_analysis(results)
         
         add_log(f"📊 arXiv搜索完成:")
         add_log(f"   - 找到匹配: {len(arxiv_found)} 篇")
@@ -201,7 +298,7 @@ def verify_citations_and_analyze_with_logs(file_path, lightweight_mode, skip_dow
         else:
             add_log("   使用标准模式: PDF内容验证")
         
-        yield add_log(""), citation_analysis, format_arxiv_analysis(results)[0], format_arxiv_analysis(results)[1], "", "正在进行AI验证..."
+        yield render_logs(), citation_analysis, arxiv_found_text, arxiv_not_found_text, "", "正在进行AI验证..."
         
         add_log(f"   正在验证 {len(citations_to_text)} 个引用标记...")
         
@@ -209,108 +306,137 @@ def verify_citations_and_analyze_with_logs(file_path, lightweight_mode, skip_dow
         verification_results = []
         
         if lightweight_mode:
-            # 轻量级模式：使用arXiv元数据
-            for i, (citation, text) in enumerate(citations_to_text):
-                add_log(f"   🔍 验证引用 {i+1}/{len(citations_to_text)}: {citation}")
+            # 轻量级模式：使用arXiv元数据，读取后台已开始的分批验证结果
+            for start, done, chunk_verification in lightweight_verification:
+                add_log(f"   🔍 验证引用 {start+1}-{done}/{len(citations_to_text)}")
+                verification_results.extend(chunk_verification)
                 
-                single_verification = batch_verify_citations_lightweight([(citation, text)], titles, "glm-4-flash")
-                verification_results.extend(single_verification)
-                
-                if single_verification and single_verification[0]['status'] == 'verified':
-                    result_text = single_verification[0].get('result', '')
-                    if '<是>' in result_text:
-                        add_log(f"      ✅ 验证通过")
-                    elif '否' in result_text:
-                        reason = result_text.replace('<否:', '').replace('>', '').strip()
-                        add_log(f"      ❌ 需要检查: {reason[:50]}...")
+                for verification in chunk_verification:
+                    citation = verification['citation']
+                    if verification['status'] == 'verified':
+                        result_text = verification.get('result', '')
+                        if _YES_TOKEN in result_text:
+                            add_log(f"      ✅ 引用{citation}验证通过")
+                        elif '否' in result_text:
+                            reason = extract_no_reason(result_text)
+                            add_log(f"      ❌ 引用{citation}需要检查: {reason[:50]}...")
+                        else:
+                            add_log(f"      ⚠️  引用{citation}结果不明确")
                     else:
-                        add_log(f"      ⚠️  结果不明确")
-                else:
-                    add_log(f"      ⏭️  跳过验证")
+                        add_log(f"      ⏭️  引用{citation}跳过验证")
                 
-                # 每验证3个引用更新一次界面
-                if (i + 1) % 3 == 0 or i == len(citations_to_text) - 1:
-                    yield add_log(""), citation_analysis, format_arxiv_analysis(results)[0], format_arxiv_analysis(results)[1], "", f"已验证 {i+1}/{len(citations_to_text)} 个引用"
+                yield render_logs(), citation_analysis, arxiv_found_text, arxiv_not_found_text, "", f"已验证 {done}/{len(citations_to_text)} 个引用"
         else:
             # 标准模式：使用PDF内容验证
             ref_dir = Path("../data/references")
-            ref_names = [int(file.stem) for file in ref_dir.iterdir() if file.is_file() and file.suffix == '.pdf']
+            # scandir复用目录项中的文件类型信息，结果存为集合供后续查找
+            with os.scandir(ref_dir) as entries:
+                ref_names = {int(entry.name[:-4]) for entry in entries if entry.is_file() and entry.name.endswith('.pdf')}
             add_log(f"   📁 引用文件夹中找到 {len(ref_names)} 个PDF文件")
             
+            # 结果按引用顺序存放，并发请求按完成顺序返回
+            ordered_results = [None] * len(citations_to_text)
+            
+            # 先跳过缺少PDF文件的引用，只为剩余引用加载PDF
+            pending = []
             for i, (citation, text) in enumerate(citations_to_text):
-                add_log(f"   🔍 验证引用 {i+1}/{len(citations_to_text)}: {citation}")
-                
                 # 检查引用的文献是否都有对应的PDF文件
-                missing_refs = set(citation) - set(ref_names)
+                missing_refs = set(citation).difference(ref_names)
                 if missing_refs:
-                    add_log(f"      ⏭️  跳过，PDF文件缺失: {sorted(missing_refs)}")
-                    verification_results.append({
+                    add_log(f"   ⏭️  引用{citation}跳过，PDF文件缺失: {sorted(missing_refs)}")
+                    ordered_results[i] = {
                         'citation': citation,
                         'status': 'skipped',
                         'reason': f'PDF文件缺失: {sorted(missing_refs)}'
-                    })
+                    }
                     continue
-                
+                pending.append((i, citation, text))
+            
+            # 每篇被引用的PDF只加载一次，多个引用之间共享文本
+            used_refs = sorted({index for _, citation, _ in pending for index in citation})
+            add_log(f"   📖 加载 {len(used_refs)} 个被引用的PDF文件")
+            pdf_texts = {}
+            pdf_errors = {}
+            for loaded, index in enumerate(used_refs, 1):
                 try:
-                    # 构建PDF文件路径并加载内容
-                    reference_paths = [ref_dir / f"{index}.pdf" for index in citation]
-                    add_log(f"      📖 加载PDF: {[f'{index}.pdf' for index in citation]}")
-                    
-                    references = load_pdf(reference_paths)
-                    
-                    if not references.strip():
-                        add_log(f"      ⚠️  PDF内容为空，跳过")
-                        verification_results.append({
-                            'citation': citation,
-                            'status': 'skipped',
-                            'reason': 'PDF内容为空'
-                        })
-                        continue
-                    
-                    # 使用PDF内容进行验证
-                    prompt_template = load_prompt("prompts/agent_prompt")
-                    prompt = prompt_template.format(text, references)
-                    
-                    client = ZhipuAI(api_key=os.environ["ZHIPUAI_API_KEY"])
-                    response = client.chat.completions.create(
-                        model="glm-4-flash",
-                        messages=[{"role": "user", "content": prompt}],
-                        temperature=0
-                    )
-                    
-                    result = response.choices[0].message.content
-                    
-                    verification_results.append({
-                        'citation': citation,
-                        'status': 'verified',
-                        'result': result
-                    })
-                    
-                    if '<是>' in result:
-                        add_log(f"      ✅ 验证通过")
-                    elif '否' in result:
-                        reason = result.replace('<否:', '').replace('>', '').strip()
-                        add_log(f"      ❌ 需要检查: {reason[:50]}...")
-                    else:
-                        add_log(f"      ⚠️  结果不明确: {result[:30]}...")
-                        
+                    pdf_texts[index] = load_pdf([ref_dir / f"{index}.pdf"])
                 except Exception as e:
-                    add_log(f"      ❌ 验证出错: {str(e)[:50]}...")
-                    verification_results.append({
+                    add_log(f"      ❌ 加载{index}.pdf出错: {str(e)[:50]}...")
+                    pdf_errors[index] = str(e)
+                
+                # 每加载3个PDF更新一次界面
+                if loaded % 3 == 0 or loaded == len(used_refs):
+                    yield render_logs(), citation_analysis, arxiv_found_text, arxiv_not_found_text, "", f"已加载 {loaded}/{len(used_refs)} 个PDF"
+            
+            tasks = []
+            for i, citation, text in pending:
+                failed_refs = [index for index in citation if index in pdf_errors]
+                if failed_refs:
+                    add_log(f"   ❌ 引用{citation}的PDF加载出错: {[f'{index}.pdf' for index in failed_refs]}")
+                    ordered_results[i] = {
                         'citation': citation,
                         'status': 'error',
-                        'reason': str(e)
-                    })
+                        'reason': pdf_errors[failed_refs[0]]
+                    }
+                    continue
                 
-                # 每验证3个引用更新一次界面
-                if (i + 1) % 3 == 0 or i == len(citations_to_text) - 1:
-                    yield add_log(""), citation_analysis, format_arxiv_analysis(results)[0], format_arxiv_analysis(results)[1], "", f"已验证 {i+1}/{len(citations_to_text)} 个引用"
+                references = "\n".join(pdf_texts[index] for index in citation)
+                
+                if not references.strip():
+                    add_log(f"   ⚠️  引用{citation}的PDF内容为空，跳过")
+                    ordered_results[i] = {
+                        'citation': citation,
+                        'status': 'skipped',
+                        'reason': 'PDF内容为空'
+                    }
+                    continue
+                
+                tasks.append((i, citation, text, references))
+            
+            # 模型请求是网络I/O密集型任务，并发发送
+            prompt_template = load_prompt("prompts/agent_prompt")
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                futures = {
+                    executor.submit(verify_with_references, prompt_template, text, references): (i, citation)
+                    for i, citation, text, references in tasks
+                }
+                for done, future in enumerate(as_completed(futures), 1):
+                    i, citation = futures[future]
+                    try:
+                        result = future.result()
+                        ordered_results[i] = {
+                            'citation': citation,
+                            'status': 'verified',
+                            'result': result
+                        }
+                        
+                        if _YES_TOKEN in result:
+                            add_log(f"      ✅ 引用{citation}验证通过")
+                        elif '否' in result:
+                            reason = extract_no_reason(result)
+                            add_log(f"      ❌ 引用{citation}需要检查: {reason[:50]}...")
+                        else:
+                            add_log(f"      ⚠️  引用{citation}结果不明确: {result[:30]}...")
+                            
+                    except Exception as e:
+                        add_log(f"      ❌ 引用{citation}验证出错: {str(e)[:50]}...")
+                        ordered_results[i] = {
+                            'citation': citation,
+                            'status': 'error',
+                            'reason': str(e)
+                        }
+                    
+                    # 每验证3个引用更新一次界面
+                    if done % 3 == 0 or done == len(futures):
+                        yield render_logs(), citation_analysis, arxiv_found_text, arxiv_not_found_text, "", f"已验证 {done}/{len(futures)} 个引用"
+            
+            verification_results.extend(ordered_results)
         
         results['verification_results'] = verification_results
         
         # 统计验证结果
         verified_count = sum(1 for r in verification_results if r['status'] == 'verified')
-        correct_count = sum(1 for r in verification_results if r['status'] == 'verified' and '<是>' in r.get('result', ''))
+        correct_count = sum(1 for r in verification_results if r['status'] == 'verified' and _YES_TOKEN in r.get('result', ''))
         incorrect_count = sum(1 for r in verification_results if r['status'] == 'verified' and '否' in r.get('result', ''))
         skipped_count = sum(1 for r in verification_results if r['status'] == 'skipped')
         error_count = sum(1 for r in verification_results if r['status'] == 'error')
@@ -338,15 +464,14 @@ def verify_citations_and_analyze_with_logs(file_path, lightweight_mode, skip_dow
         
         # 格式化最终结果
         citation_analysis = format_citation_analysis(results)
-        arxiv_found_text, arxiv_not_found_text = format_arxiv_analysis(results)
         verified_correct, verified_incorrect = format_verification_results(results)
         
-        yield add_log(""), citation_analysis, arxiv_found_text, arxiv_not_found_text, verified_correct, verified_incorrect, "✅ 分析完成！"
+        yield render_logs(), citation_analysis, arxiv_found_text, arxiv_not_found_text, verified_correct, verified_incorrect, "✅ 分析完成！"
         
     except Exception as e:
         error_msg = f"❌ 错误: {str(e)}"
         add_log(error_msg)
-        yield add_log(""), error_msg, "", "", "", error_msg
+        yield render_logs(), error_msg, "", "", "", error_msg
 
 def format_citation_analysis(results):
     """格式化引文分析结果"""
@@ -355,58 +480,58 @@ def format_citation_analysis(results):
     
     info = results['citations_info']
     
-    output = f"""📊 **引文分析结果**
+    parts = [f"""📊 **引文分析结果**
 
 **基本统计:**
 - 参考文献总数：{info['total_references']} 篇
 - 引用标记总数：{info['total_citations']} 个
 - 不重复引用数：{info['unique_citations']} 个
 
-**未被引用的文献：**"""
+**未被引用的文献：**"""]
     
     if info['missed_citations']:
-        output += f"\n⚠️ 共 {len(info['missed_citations'])} 篇文献未被引用："
+        parts.append(f"\n⚠️ 共 {len(info['missed_citations'])} 篇文献未被引用：")
         for citation in sorted(info['missed_citations']):
-            output += f"\n   - 文献[{citation}]: {results['titles'][citation-1] if citation <= len(results['titles']) else '标题未知'}"
+            parts.append(f"\n   - 文献[{citation}]: {results['titles'][citation-1] if citation <= len(results['titles']) else '标题未知'}")
     else:
-        output += "\n✅ 所有文献都被引用了"
+        parts.append("\n✅ 所有文献都被引用了")
     
-    output += "\n\n**重复引用的文献：**"
+    parts.append("\n\n**重复引用的文献：**")
     if info['duplicate_citations']:
-        output += f"\n⚠️ 共 {len(info['duplicate_citations'])} 篇文献被重复引用："
+        parts.append(f"\n⚠️ 共 {len(info['duplicate_citations'])} 篇文献被重复引用：")
         for citation, count in info['citation_details']:
-            output += f"\n   - 文献[{citation}]：被引用 {count} 次"
+            parts.append(f"\n   - 文献[{citation}]：被引用 {count} 次")
     else:
-        output += "\n✅ 没有重复引用的文献"
+        parts.append("\n✅ 没有重复引用的文献")
     
-    return output
+    return "".join(parts)
 
 def format_arxiv_analysis(results):
     """格式化arXiv分析结果"""
     if 'error' in results:
         return f"❌ 错误: {results['error']}", f"❌ 错误: {results['error']}"
     
-    found_output = "📚 **arXiv中可以找到的文献：**\n\n"
+    found_parts = ["📚 **arXiv中可以找到的文献：**\n\n"]
     if results['arxiv_found']:
         for item in results['arxiv_found']:
-            found_output += f"**[{item['index']}]** {item['title']}\n"
-            found_output += f"   - 匹配标题：{item['arxiv_title']}\n"
-            found_output += f"   - 相似度：{item['similarity']:.3f}\n"
-            found_output += f"   - 作者：{', '.join(item['authors'][:3])}{'...' if len(item['authors']) > 3 else ''}\n\n"
+            found_parts.append(f"**[{item['index']}]** {item['title']}\n")
+            found_parts.append(f"   - 匹配标题：{item['arxiv_title']}\n")
+            found_parts.append(f"   - 相似度：{item['similarity']:.3f}\n")
+            found_parts.append(f"   - 作者：{', '.join(item['authors'][:3])}{'...' if len(item['authors']) > 3 else ''}\n\n")
     else:
-        found_output += "❌ 没有在arXiv中找到匹配的文献"
+        found_parts.append("❌ 没有在arXiv中找到匹配的文献")
     
-    not_found_output = "📚 **arXiv中不可以找到的文献：**\n\n"
+    not_found_parts = ["📚 **arXiv中不可以找到的文献：**\n\n"]
     if results['arxiv_not_found']:
         for item in results['arxiv_not_found']:
-            not_found_output += f"**[{item['index']}]** {item['title']}\n"
+            not_found_parts.append(f"**[{item['index']}]** {item['title']}\n")
             if 'error' in item:
-                not_found_output += f"   - 错误：{item['error']}\n"
-            not_found_output += "\n"
+                not_found_parts.append(f"   - 错误：{item['error']}\n")
+            not_found_parts.append("\n")
     else:
-        not_found_output += "✅ 所有文献都在arXiv中找到了"
+        not_found_parts.append("✅ 所有文献都在arXiv中找到了")
     
-    return found_output, not_found_output
+    return "".join(found_parts), "".join(not_found_parts)
 
 def format_verification_results(results):
     """格式化验证结果"""
@@ -422,11 +547,11 @@ def format_verification_results(results):
     for result in results['verification_results']:
         if result['status'] == 'verified':
             citation_str = str(result['citation'])
-            if '<是>' in result.get('result', ''):
+            if _YES_TOKEN in result.get('result', ''):
                 verified_correct.append(citation_str)
             elif '否' in result.get('result', ''):
                 ai_result = result.get('result', '')
-                reason = ai_result.replace('<否:', '').replace('>', '').strip()
+                reason = extract_no_reason(ai_result)
                 
                 # 获取文献标题
                 citation_titles = []
@@ -441,29 +566,29 @@ def format_verification_results(results):
                 })
     
     # 格式化查验无误的结果
-    correct_output = "✅ **查验无误的文献：**\n\n"
+    correct_parts = ["✅ **查验无误的文献：**\n\n"]
     if verified_correct:
-        correct_output += f"共 {len(verified_correct)} 个引用查验无误：\n"
+        correct_parts.append(f"共 {len(verified_correct)} 个引用查验无误：\n")
         for citation in verified_correct:
-            correct_output += f"- 引用 {citation}\n"
+            correct_parts.append(f"- 引用 {citation}\n")
     else:
-        correct_output += "⚠️ 没有查验无误的引用"
+        correct_parts.append("⚠️ 没有查验无误的引用")
     
     # 格式化需要检查的结果
-    incorrect_output = "⚠️ **相关性低，需重点检查的文献：**\n\n"
+    incorrect_parts = ["⚠️ **相关性低，需重点检查的文献：**\n\n"]
     if verified_incorrect:
-        incorrect_output += f"共 {len(verified_incorrect)} 个引用需要重点检查：\n\n"
+        incorrect_parts.append(f"共 {len(verified_incorrect)} 个引用需要重点检查：\n\n")
         for i, item in enumerate(verified_incorrect, 1):
-            incorrect_output += f"**{i}. 引用 {item['citation']}**\n"
+            incorrect_parts.append(f"**{i}. 引用 {item['citation']}**\n")
             if item['titles']:
-                incorrect_output += f"   - 标题：{'; '.join(item['titles'])}\n"
-            incorrect_output += f"   - 理由：{item['reason']}\n\n"
+                incorrect_parts.append(f"   - 标题：{'; '.join(item['titles'])}\n")
+            incorrect_parts.append(f"   - 理由：{item['reason']}\n\n")
     else:
-        incorrect_output += "✅ 所有验证的引用都相关性良好"
+        incorrect_parts.append("✅ 所有验证的引用都相关性良好")
     
-    return correct_output, incorrect_output
+    return "".join(correct_parts), "".join(incorrect_parts)
 
-def process_document(file, lightweight, skip_download, pdf_verify):
+def process_document(file, lightweight, skip_download, pdf_verify, force_refresh):
     """处理上传的文档，带实时日志更新"""
     if file is None:
         yield "请先上传文档", "", "", "", "", "", ""
@@ -471,7 +596,7 @@ def process_document(file, lightweight, skip_download, pdf_verify):
     
     try:
         # 使用带日志的分析函数
-        for result in verify_citations_and_analyze_with_logs(file.name, lightweight, skip_download, pdf_verify):
+        for result in verify_citations_and_analyze_with_logs(file.name, lightweight, skip_download, pdf_verify, force_refresh):
             if len(result) == 6:  # 中间结果
                 logs, citation, arxiv_found, arxiv_not_found, verified_correct, status = result
                 yield logs, citation, arxiv_found, arxiv_not_found, verified_correct, "", status
@@ -531,6 +656,11 @@ def create_interface():
                     value=False,
                     info="使用本地PDF进行深度验证"
                 )
+                force_refresh = gr.Checkbox(
+                    label="强制刷新",
+                    value=False,
+                    info="忽略缓存，重新解析文档"
+                )
                 
                 process_btn = gr.Button(
                     "🚀 开始检查",
@@ -605,7 +735,7 @@ def create_interface():
         # 事件绑定
         process_btn.click(
             fn=process_document,
-            inputs=[file_input, lightweight_mode, skip_download, pdf_verify],
+            inputs=[file_input, lightweight_mode, skip_download, pdf_verify, force_refresh],
             outputs=[logs, citation_analysis, arxiv_found, arxiv_not_found, verified_correct, verified_incorrect, status]
         )
         
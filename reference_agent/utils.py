@@ -1,20 +1,192 @@
+import io
 import re
 import os
+import json
+import time
+import pickle
+import hashlib
+from pathlib import Path
+from urllib.request import urlretrieve
 import arxiv
 import fitz
 from ast import literal_eval
 from zhipuai import ZhipuAI
 import logging
-from difflib import SequenceMatcher
+import threading
+from collections import Counter
+from bisect import bisect_right
+from functools import lru_cache
+from rapidfuzz import fuzz, process
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 logger = logging.getLogger(__name__)
 
+# 本地缓存目录，用于跨运行复用arXiv查询等网络请求结果
+CACHE_DIR = Path.home() / ".cache" / "reference_agent"
+ARXIV_CACHE_TTL = 7 * 86400  # arXiv查询结果缓存7天
+TITLE_SIMILARITY_THRESHOLD = 0.8  # 标题匹配的相似度阈值
+VERIFY_CHUNK_SIZE = 10  # 每次请求模型验证的引文数量
+LLM_CACHE_VERSION = 2  # 修改提取用的提示词后递增，使已缓存的模型结果失效
+# 只需纯文本做引用匹配，明确使用纯文本模式且不处理图片
+PDF_TEXT_FLAGS = fitz.TEXTFLAGS_TEXT & ~fitz.TEXT_PRESERVE_IMAGES
+# 待解析PDF的总大小超过该值时才使用进程池，文件较少较小时启动子进程的开销大于并行带来的收益
+PDF_POOL_MIN_BYTES = 16 * 1024 * 1024
+
+_arxiv_memo = {}
+# 每个查询一把锁，并发查询同一标题时只有一个线程真正访问arXiv
+_arxiv_key_locks = {}
+_arxiv_key_locks_guard = threading.Lock()
+# 所有线程共用的arXiv请求间隔，arXiv要求两次请求之间至少间隔3秒
+ARXIV_REQUEST_INTERVAL = 3.0
+_arxiv_rate_lock = threading.Lock()
+_arxiv_next_request = 0.0  # 下一个请求最早可以发出的时刻
+
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_WS_RE = re.compile(r'\s+')
+_SENT_END_RE = re.compile(r'[.!?]\s+|[。！？]')
+# 匹配 [1], [1,2], [1, 2, 3], [ 1 ] 等格式
+_CITE_RE = re.compile(r'\[\s*(\d+(?:\s*,\s*\d+)*)\s*\]')
+_CITE_LINE_RE = re.compile(r'\[(\d+(?:,\s*\d+)*)\].*?"([^"]*)"?')
+_BRACKET_RE = re.compile(r'\[([^\]]+)\]')
+# 标题开头的序号，如[1]、1.、(1)，可能连续出现多个
+_LEAD_NUM_RE = re.compile(r'^(?:(?:\[\d+\]|\d+\.|\(\d+\))\s*)+')
+
+def _cache_path(kind, key):
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return CACHE_DIR / kind / f"{digest}.pkl"
+
+def cache_get(kind, key, max_age=None):
+    """读取磁盘缓存，不存在或已过期时返回None"""
+    path = _cache_path(kind, key)
+    try:
+        if max_age is not None and time.time() - path.stat().st_mtime > max_age:
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+def cache_set(kind, key, value):
+    """写入磁盘缓存，写入失败时仅记录日志"""
+    path = _cache_path(kind, key)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 临时文件名带上进程和线程编号，同一进程内多个线程写同一个键时互不干扰
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"缓存写入失败: {e}")
+
+def cache_prune(kind, max_age):
+    """删除某类缓存中超过max_age秒未更新的文件，避免缓存目录无限增长"""
+    now = time.time()
+    for path in (CACHE_DIR / kind).glob("*.pkl"):
+        try:
+            if now - path.stat().st_mtime > max_age:
+                path.unlink()
+        except OSError:
+            pass
+
+def file_digest(path):
+    """计算文件内容的摘要，用作解析结果的缓存键，分块读取避免整个文件载入内存"""
+    with open(path, 'rb') as f:
+        if hasattr(hashlib, 'file_digest'):  # Python 3.11+
+            return hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+        h = hashlib.blake2b(digest_size=16)
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+        return h.hexdigest()
+
+@lru_cache(maxsize=4096)
+def clean_title_for_comparison(title):
+    """清理标题用于比较，去除标点符号、转换为小写等"""
+    # 去除常见的标点符号和特殊字符
+    cleaned = _PUNCT_RE.sub(' ', title.lower())
+    # 去除多余空格
+    return _WS_RE.sub(' ', cleaned).strip()
+
+def prepare_title(title):
+    """预先计算标题的小写形式、清理结果和词集合，供多次比较复用"""
+    cleaned = clean_title_for_comparison(title)
+    return title.lower(), cleaned, set(cleaned.split())
+
+def length_upper_bound(a, b):
+    """由长度得到的相似度上界：fuzz.ratio不超过2*min/(len(a)+len(b))，词重叠不超过min/max"""
+    total = len(a) + len(b)
+    return 2 * min(len(a), len(b)) / total if total else 0
+
+def score_candidates(prepared_title, candidate_titles, threshold=TITLE_SIMILARITY_THRESHOLD):
+    """批量计算候选标题与参考文献标题的相似度，取三种度量中的最大值，顺序与candidate_titles一致；
+    被长度预筛排除的候选不计算相似度，对应位置为None"""
+    lower_title, clean_title, words = prepared_title
+    candidates = [prepare_title(candidate) for candidate in candidate_titles]
+    
+    # 按长度预筛：三种度量的上界都不超过阈值的候选不可能匹配，无需计算编辑距离
+    choices = {}
+    for j, (candidate_lower, candidate_clean, candidate_words) in enumerate(candidates):
+        bound = max(
+            length_upper_bound(lower_title, candidate_lower),
+            length_upper_bound(clean_title, candidate_clean),
+            min(len(words), len(candidate_words)) / max(len(words), len(candidate_words), 1)
+        )
+        if bound > threshold:
+            choices[j] = (candidate_lower, candidate_clean)
+    
+    # 两种编辑距离相似度各用一次C调用完成所有候选的打分
+    similarities1 = [0.0] * len(candidates)
+    similarities2 = [0.0] * len(candidates)
+    for _, score, j in process.extract(lower_title, {j: c[0] for j, c in choices.items()}, scorer=fuzz.ratio, processor=None, limit=None):
+        similarities1[j] = score / 100
+    for _, score, j in process.extract(clean_title, {j: c[1] for j, c in choices.items()}, scorer=fuzz.ratio, processor=None, limit=None):
+        similarities2[j] = score / 100
+    
+    scores = []
+    for j, (similarity1, similarity2, (_, _, candidate_words)) in enumerate(zip(similarities1, similarities2, candidates)):
+        if j not in choices:
+            scores.append(None)
+            continue
+        if len(words) > 0 and len(candidate_words) > 0:
+            word_overlap = len(words.intersection(candidate_words)) / len(words.union(candidate_words))
+        else:
+            word_overlap = 0
+        scores.append(max(similarity1, similarity2, word_overlap))
+    return scores
+
+def score_title_candidates(title, candidates):
+    """批量计算候选标题与参考文献标题的相似度(0-1)，顺序与candidates一致，被预筛排除的候选为None"""
+    return score_candidates(prepare_title(title), candidates)
+
+@lru_cache(maxsize=1)
+def get_zhipu_client():
+    """获取共享的ZhipuAI客户端，复用HTTP连接池"""
+    return ZhipuAI(api_key=os.environ["ZHIPUAI_API_KEY"])
+
+@lru_cache(maxsize=1)
+def get_arxiv_client():
+    """获取共享的arXiv客户端，复用连接；请求间隔由search_from_arxiv统一控制，客户端自身不再等待"""
+    # arxiv.Client自身的请求间隔检查没有加锁，多线程共用时并不可靠，因此关闭
+    return arxiv.Client(delay_seconds=0)
+
+def count_citations(citations, num_references):
+    """按引用编号统计被引次数，返回以编号为下标的计数列表(类似bincount)，以及超出参考文献编号范围的计数"""
+    counts = [0] * (num_references + 1)
+    # 正文中的[20230415]之类也会被当作引用编号，超出范围的编号单独计数，避免按编号分配超大列表
+    out_of_range = Counter()
+    for citation in citations:
+        if 0 <= citation <= num_references:
+            counts[citation] += 1
+        else:
+            out_of_range[citation] += 1
+    return counts, out_of_range
+
+@lru_cache(maxsize=None)
 def load_prompt(file):
-    prompt = ""
+    """读取提示词模板，同一文件只读取一次"""
     with open(file, 'r', encoding='utf-8') as f:
-        for line in f:
-            prompt += line
-    return prompt
+        return f.read()
 
 def normalize_doc(doc):
     paragraphs = [paragraph.text for paragraph in doc.paragraphs if paragraph.text]
@@ -28,13 +200,18 @@ def get_reference_titles(doc_content):
 def parse_citation_line(line):
     """解析单行引用标记，支持多种格式"""
     line = line.strip()
-    if not line:
+    # 不含[的行不可能包含引用编号列表，无需解析
+    if not line or '[' not in line:
         return None
     
-    try:
-        # 尝试直接解析
-        return literal_eval(line)
-    except (SyntaxError, ValueError):
+    # 只有形如Python字面量的行才尝试literal_eval，其余直接使用正则表达式提取
+    if line[0] in '[(':
+        try:
+            # 尝试直接解析
+            return literal_eval(line)
+        except (SyntaxError, ValueError):
+            pass
+        
         # 如果直接解析失败，尝试修复常见格式问题
         try:
             # 处理缺少结束引号的情况
@@ -48,83 +225,56 @@ def parse_citation_line(line):
                 line = line + ')'
             return literal_eval(line)
         except (SyntaxError, ValueError):
-            # 最后尝试正则表达式提取
-            pattern = r'\[(\d+(?:,\s*\d+)*)\].*?"([^"]*)"?'
-            match = re.search(pattern, line)
-            if match:
-                citation_str = match.group(1)
-                text = match.group(2)
-                citations = [int(x.strip()) for x in citation_str.split(',')]
-                return [citations, text]
-            else:
-                logger.warning(f"无法解析的引用标记格式: {line}")
-                return None
+            pass
+    
+    # 最后尝试正则表达式提取
+    match = _CITE_LINE_RE.search(line)
+    if match:
+        citation_str = match.group(1)
+        text = match.group(2)
+        citations = [int(x.strip()) for x in citation_str.split(',')]
+        return [citations, text]
+    else:
+        logger.warning(f"无法解析的引用标记格式: {line}")
+        return None
 
 def extract_citations_with_regex(content):
     """使用正则表达式提取引用标记作为备用方法"""
     results = []
-    
-    # 多种引用标记模式
-    patterns = [
-        # 匹配 [1], [1,2], [1, 2, 3] 等格式
-        r'\[(\d+(?:\s*,\s*\d+)*)\]',
-        # 匹配可能有空格的情况
-        r'\[\s*(\d+(?:\s*,\s*\d+)*)\s*\]'
-    ]
-    
     all_citations = set()
-    
-    for pattern in patterns:
-        matches = re.finditer(pattern, content)
-        for match in matches:
-            citation_str = match.group(1)
-            # 解析引用编号
-            citations = []
-            for num_str in citation_str.split(','):
-                try:
-                    num = int(num_str.strip())
-                    citations.append(num)
-                    all_citations.add(num)
-                except ValueError:
-                    continue
-            
-            if citations:
-                # 提取引用前后的上下文作为句子
-                start = max(0, match.start() - 100)
-                end = min(len(content), match.end() + 100)
-                context = content[start:end].strip()
-                
-                # 尝试找到完整的句子
-                sentences = re.split(r'[.!?]\s+', context)
-                target_sentence = ""
-                for sentence in sentences:
-                    if match.group(0) in sentence:
-                        target_sentence = sentence.strip()
-                        break
-                
-                if not target_sentence:
-                    target_sentence = context
-                
-                results.append([citations, target_sentence])
-    
-    # 去重并按引用编号排序
-    unique_results = []
     seen_citations = set()
     
-    for citations, text in results:
+    # 预先计算全文的句子边界，每个引用标记按位置二分查找所在句子
+    boundaries = [0] + [m.end() for m in _SENT_END_RE.finditer(content)] + [len(content)]
+    
+    for match in _CITE_RE.finditer(content):
+        # 解析引用编号，int()可以直接处理编号两侧的空格
+        citations = list(map(int, match.group(1).split(',')))
+        all_citations.update(citations)
+        
+        # 相同的引用组合只保留第一次出现
         citation_key = tuple(sorted(citations))
-        if citation_key not in seen_citations:
-            seen_citations.add(citation_key)
-            unique_results.append([citations, text])
+        if citation_key in seen_citations:
+            continue
+        seen_citations.add(citation_key)
+        
+        # 引用所在的句子，截取到引用前后100个字符以内
+        k = bisect_right(boundaries, match.start())
+        start = max(boundaries[k - 1], match.start() - 100)
+        end = min(boundaries[k], match.end() + 100)
+        target_sentence = content[start:end].strip()
+        
+        results.append([citations, target_sentence])
     
-    unique_results.sort(key=lambda x: min(x[0]))
+    # 按引用编号排序
+    results.sort(key=lambda x: min(x[0]))
     
-    logger.info(f"正则表达式方法提取到{len(unique_results)}个引用标记")
+    logger.info(f"正则表达式方法提取到{len(results)}个引用标记")
     logger.info(f"发现的所有引用编号: {sorted(all_citations)}")
-    return unique_results
+    return results
 
-def get_citation_markers(content):
-    """使用AI模型提取引用标记，并添加备用的正则表达式方法"""
+def get_citation_markers(content, num_references=None):
+    """使用AI模型提取引用标记，并添加备用的正则表达式方法；num_references为参考文献数量，用于判断正则结果是否已覆盖全部文献"""
     try:
         if not content:
             print("警告: 文档内容为空")
@@ -133,48 +283,33 @@ def get_citation_markers(content):
         # 首先使用正则表达式方法作为主要方法，因为它更可靠
         regex_results = extract_citations_with_regex(content)
         
-        # 如果正则表达式找到了足够的结果，直接返回
-        if len(regex_results) > 10:  # 假设正常文档应该有超过10个引用
+        # 如果正则表达式找到了足够的结果，或每篇参考文献都已被引用(没有需要模型补充的引用)，直接返回
+        cited_numbers = {num for citation, _ in regex_results for num in citation}
+        all_cited = bool(num_references) and all(num in cited_numbers for num in range(1, num_references + 1))
+        if len(regex_results) > 10 or all_cited:  # 假设正常文档应该有超过10个引用
             print(f"提取到{len(regex_results)}个引用标记")
             return regex_results
         
+        # 相同内容的AI提取结果直接从缓存读取
+        cache_key = f"{LLM_CACHE_VERSION}:glm-4-flash:{content}"
+        cached = cache_get("citation_markers", cache_key)
+        if cached is not None:
+            print(f"提取到{len(cached)}个引用标记(缓存)")
+            return cached
+        
         # 否则尝试AI方法作为补充
         try:
-            client = ZhipuAI(api_key=os.environ["ZHIPUAI_API_KEY"])
+            client = get_zhipu_client()
             
             # 由于内容可能很长，我们分段处理
             chunk_size = 8000  # 每段8000字符
-            all_ai_results = []
+            chunks = _split_text_chunks(content, chunk_size)
             
-            for i in range(0, len(content), chunk_size):
-                chunk = content[i:i+chunk_size]
-                
-                prompt = """请从以下文本中提取所有文献引用标记及对应段落：
-1. 识别形如[1]或[1,2,3]或[1, 2, 3]的引用标记
-2. 每个引用标记单独一行，格式：引用编号列表|对应段落文本
-3. 例如：[1, 2, 3]|这是包含引用的段落文本
-
-文本内容：
-{content}"""
-
-                response = client.chat.completions.create(
-                    model="glm-4-flash",
-                    messages=[{"role": "user", "content": prompt.format(content=chunk)}],
-                    temperature=0
-                )
-                
-                # 解析AI响应
-                for line in response.choices[0].message.content.split('\n'):
-                    if '|' in line and '[' in line:
-                        try:
-                            citation_part, text_part = line.split('|', 1)
-                            citation_match = re.search(r'\[([^\]]+)\]', citation_part)
-                            if citation_match:
-                                citation_str = citation_match.group(1)
-                                citations = [int(x.strip()) for x in citation_str.split(',')]
-                                all_ai_results.append([citations, text_part.strip()])
-                        except (ValueError, IndexError):
-                            continue
+            # 各段相互独立，并发请求模型，结果仍按分段顺序合并
+            all_ai_results = []
+            with ThreadPoolExecutor(max_workers=min(8, len(chunks))) as executor:
+                for chunk_results in executor.map(lambda chunk: _extract_citations_from_chunk(client, chunk), chunks):
+                    all_ai_results.extend(chunk_results)
             
             # 合并正则表达式和AI结果
             combined_results = regex_results[:]
@@ -187,6 +322,7 @@ def get_citation_markers(content):
                     combined_results.append(result)
                     existing_citations.update(result[0])
             
+            cache_set("citation_markers", cache_key, combined_results)
             print(f"提取到{len(combined_results)}个引用标记")
             return combined_results
             
@@ -198,29 +334,157 @@ def get_citation_markers(content):
         print(f"引用标记提取失败: {str(e)[:30]}...")
         return []
 
+def _parse_json_array(content):
+    """从模型回复中截取并解析JSON数组，失败时返回None"""
+    try:
+        parsed = json.loads(content[content.index('['):content.rindex(']') + 1])
+    except ValueError:
+        return None
+    return parsed if isinstance(parsed, list) else None
+
+def _split_text_chunks(content, chunk_size):
+    """按不超过chunk_size的长度切分文本，尽量在段落或行末断开，避免截断句子"""
+    chunks = []
+    start = 0
+    while start < len(content):
+        end = start + chunk_size
+        if end < len(content):
+            # 在后半段中寻找最近的段落边界，找不到时退而寻找行边界
+            cut = content.rfind('\n\n', start + chunk_size // 2, end)
+            if cut == -1:
+                cut = content.rfind('\n', start + chunk_size // 2, end)
+            if cut != -1:
+                end = cut + 1
+        chunks.append(content[start:end])
+        start = end
+    return chunks
+
+def _extract_citations_from_chunk(client, chunk):
+    """使用AI模型从一段文本中提取引用标记"""
+    prompt = """请从以下文本中提取所有文献引用标记及对应段落：
+1. 识别形如[1]或[1,2,3]或[1, 2, 3]的引用标记
+2. 只输出一个JSON数组，每个引用标记对应一个元素，cites为引用编号列表，text为对应段落文本，不要输出其他内容
+3. 例如：[{{"cites": [1, 2, 3], "text": "这是包含引用的段落文本"}}]
+
+文本内容：
+{content}"""
+
+    response = client.chat.completions.create(
+        model="glm-4-flash",
+        messages=[{"role": "user", "content": prompt.format(content=chunk)}],
+        temperature=0
+    )
+    
+    answer = response.choices[0].message.content
+    parsed = _parse_json_array(answer)
+    if parsed is not None and all(isinstance(item, dict) for item in parsed):
+        results = []
+        for item in parsed:
+            try:
+                citations = [int(x) for x in item['cites']]
+                results.append([citations, str(item['text']).strip()])
+            except (TypeError, KeyError, ValueError):
+                continue
+        return results
+    
+    # 模型未按JSON输出时退回按行解析
+    results = []
+    for line in answer.split('\n'):
+        if '|' in line and '[' in line:
+            try:
+                citation_part, text_part = line.split('|', 1)
+                citation_match = _BRACKET_RE.search(citation_part)
+                if citation_match:
+                    citation_str = citation_match.group(1)
+                    citations = [int(x.strip()) for x in citation_str.split(',')]
+                    results.append([citations, text_part.strip()])
+            except (ValueError, IndexError):
+                continue
+    return results
+
+def _extract_pdf_text(file):
+    """提取单个PDF文件的全部文本，逐页写入缓冲区，不保留所有页面文本的列表"""
+    buf = io.StringIO()
+    separator = ""
+    with fitz.open(file) as pdf:
+        for page in pdf:
+            buf.write(separator)
+            buf.write(page.get_text("text", flags=PDF_TEXT_FLAGS))
+            separator = "\n"
+    return buf.getvalue()
+
+@lru_cache(maxsize=1)
+def _get_pdf_pool():
+    """懒加载解析PDF用的进程池"""
+    return ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+
 def load_pdf(files):
     """加载PDF文件内容"""
     if not isinstance(files, list):
         logger.error("参数必须为list类型")
         raise TypeError("references参数应为list类型")
         
-    text = []
     try:
-        for file in files:
-            with fitz.open(file) as pdf:
-                text.extend(page.get_text() for page in pdf)
-        return "\n".join(text)
+        if len(files) > 1 and sum(os.path.getsize(file) for file in files) >= PDF_POOL_MIN_BYTES:
+            # PyMuPDF解析期间持有GIL，较大的一批文件放到进程池中并行解析
+            try:
+                texts = list(_get_pdf_pool().map(_extract_pdf_text, files))
+            except BrokenProcessPool:
+                # 子进程崩溃后进程池不可再用，重建进程池后重试一次
+                _get_pdf_pool.cache_clear()
+                try:
+                    texts = list(_get_pdf_pool().map(_extract_pdf_text, files))
+                except BrokenProcessPool:
+                    _get_pdf_pool.cache_clear()
+                    raise
+        else:
+            texts = map(_extract_pdf_text, files)
+        return "\n".join(texts)
     except Exception as e:
         logger.error(f"PDF加载失败: {str(e)}")
         raise
 
-def search_from_arxiv(query):
-    client = arxiv.Client()
+def _wait_for_arxiv_slot():
+    """为本次请求预留发出时刻并等待到该时刻；按请求开始时间间隔ARXIV_REQUEST_INTERVAL秒，
+    锁只在预留时持有，因此各线程的请求可以同时进行"""
+    global _arxiv_next_request
+    with _arxiv_rate_lock:
+        start = max(time.monotonic(), _arxiv_next_request)
+        _arxiv_next_request = start + ARXIV_REQUEST_INTERVAL
+    wait = start - time.monotonic()
+    if wait > 0:
+        time.sleep(wait)
+
+def search_from_arxiv(query, max_results=5):
+    client = get_arxiv_client()
     search = arxiv.Search(
         query=query,
-        max_results=5
+        max_results=max_results
     )
-    return client.results(search)
+    _wait_for_arxiv_slot()
+    # results()是惰性的，请求在遍历时才发出，因此在等待结束后立即取回全部结果
+    return list(client.results(search))
+
+def search_titles_from_arxiv(titles, max_workers=4):
+    """并发在arXiv中搜索多个标题，按完成顺序逐个返回(序号, 标题, 搜索结果, 异常)"""
+    # 规范化后相同的标题只搜索一次，结果分发给组内所有序号
+    groups = {}
+    for i, title in enumerate(titles):
+        groups.setdefault(clean_title_for_comparison(title), []).append((i, title))
+
+    # 搜索是网络I/O密集型任务，并发等待响应；请求的发出由search_from_arxiv统一限速
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(get_arxiv_metadata_only, group[0][1]): group
+            for group in groups.values()
+        }
+        for future in as_completed(futures):
+            try:
+                search_results, error = future.result(), None
+            except Exception as e:
+                search_results, error = [], e
+            for i, title in futures[future]:
+                yield i, title, search_results, error
 
 def extract_references_with_ai(content, model="glm-4-flash"):
     """使用AI模型从文本内容中提取参考文献标题"""
@@ -228,19 +492,24 @@ def extract_references_with_ai(content, model="glm-4-flash"):
         if not content:
             print("警告: 文档内容为空")
             return []
+        
+        # 相同内容和模型的提取结果直接从缓存读取
+        cache_key = f"{LLM_CACHE_VERSION}:{model}:{content}"
+        cached = cache_get("reference_titles", cache_key)
+        if cached is not None:
+            print(f"提取到{len(cached)}篇参考文献标题(缓存)")
+            return cached
             
-        client = ZhipuAI(api_key=os.environ["ZHIPUAI_API_KEY"])
+        client = get_zhipu_client()
         
         prompt = """请从以下文本中精确提取参考文献部分的论文标题列表：
 1. 只返回参考文献章节中的论文标题  
 2. 忽略作者、期刊、年份、序号等信息
 3. 标题不要包含序号（如[1]、1.等）
-4. 输出格式为纯文本，每行一个标题
+4. 只输出一个JSON字符串数组，每个元素为一个标题，不要输出其他内容
 
 示例输出：
-Single image super-resolution using deep convolutional networks
-Enhanced deep residual networks for single image super-resolution
-Image super-resolution using very deep convolutional networks
+["Single image super-resolution using deep convolutional networks", "Enhanced deep residual networks for single image super-resolution", "Image super-resolution using very deep convolutional networks"]
 
 文本内容：
 {content}"""
@@ -251,21 +520,19 @@ Image super-resolution using very deep convolutional networks
             temperature=0
         )
         
-        raw_titles = [title.strip() for title in response.choices[0].message.content.split('\n') if title.strip()]
+        answer = response.choices[0].message.content
+        parsed = _parse_json_array(answer)
+        if parsed is not None and all(isinstance(title, str) for title in parsed):
+            raw_titles = [title.strip() for title in parsed if title.strip()]
+        else:
+            # 模型未按JSON输出时退回按行解析
+            raw_titles = [title.strip() for title in answer.split('\n') if title.strip()]
         
-        # 进一步清理标题，去除可能残留的序号
-        clean_titles = []
-        for title in raw_titles:
-            # 使用正则表达式去除开头的序号
-            cleaned_title = re.sub(r'^\[\d+\]\s*', '', title)  # 去除[1] 
-            cleaned_title = re.sub(r'^\d+\.\s*', '', cleaned_title)  # 去除1. 
-            cleaned_title = re.sub(r'^\(\d+\)\s*', '', cleaned_title)  # 去除(1) 
-            cleaned_title = cleaned_title.strip()
-            
-            # 确保标题不为空且有意义
-            if len(cleaned_title) > 10 and not cleaned_title.isdigit():
-                clean_titles.append(cleaned_title)
+        # 进一步清理标题，去除可能残留的序号，并确保标题不为空且有意义
+        cleaned_titles = (_LEAD_NUM_RE.sub('', title).strip() for title in raw_titles)
+        clean_titles = [title for title in cleaned_titles if len(title) > 10 and not title.isdigit()]
         
+        cache_set("reference_titles", cache_key, clean_titles)
         print(f"提取到{len(clean_titles)}篇参考文献标题")
         return clean_titles
         
@@ -276,32 +543,47 @@ Image super-resolution using very deep convolutional networks
         print(f"参考文献提取失败: {str(e)}")
         return []
 
+def _result_to_metadata(result):
+    return {
+        'title': result.title,
+        'authors': [str(author) for author in result.authors],
+        'abstract': result.summary,
+        'published': result.published,
+        'updated': result.updated,
+        'categories': result.categories,
+        'arxiv_id': result.entry_id,
+        'pdf_url': result.pdf_url,
+        'doi': getattr(result, 'doi', None),
+        'journal_ref': getattr(result, 'journal_ref', None)
+    }
+
 def get_arxiv_metadata_only(query, max_results=5):
-    """获取arXiv论文元数据而不下载PDF"""
-    client = arxiv.Client()
-    search = arxiv.Search(
-        query=query,
-        max_results=max_results
-    )
-    
-    results = []
-    for result in client.results(search):
-        metadata = {
-            'title': result.title,
-            'authors': [str(author) for author in result.authors],
-            'abstract': result.summary,
-            'published': result.published,
-            'updated': result.updated,
-            'categories': result.categories,
-            'arxiv_id': result.entry_id,
-            'pdf_url': result.pdf_url,
-            'doi': getattr(result, 'doi', None),
-            'journal_ref': getattr(result, 'journal_ref', None)
-        }
-        results.append(metadata)
-    
+    """获取arXiv论文元数据而不下载PDF，结果按规范化标题缓存在内存和磁盘中"""
+    key = f"{max_results}:{clean_title_for_comparison(query)}"
+    if key in _arxiv_memo:
+        return _arxiv_memo[key]
+
+    with _arxiv_key_locks_guard:
+        key_lock = _arxiv_key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        # 等锁期间其他线程可能已经查询完成
+        if key in _arxiv_memo:
+            return _arxiv_memo[key]
+
+        results = cache_get("arxiv", key, max_age=ARXIV_CACHE_TTL)
+        if results is None:
+            results = [_result_to_metadata(result) for result in search_from_arxiv(query, max_results)]
+            cache_set("arxiv", key, results)
+
+        _arxiv_memo[key] = results
     return results
 
+def download_arxiv_pdf(metadata, dirpath, filename):
+    """根据arXiv元数据下载论文PDF"""
+    path = os.path.join(dirpath, filename)
+    written_path, _ = urlretrieve(metadata['pdf_url'], path)
+    return written_path
+
 def verify_citation_with_metadata(citation_text, paper_metadata):
     """使用论文元数据验证引用，无需下载PDF"""
     # 构建用于验证的文本内容（标题+摘要）
@@ -315,10 +597,45 @@ def verify_citation_with_metadata(citation_text, paper_metadata):
     
     return reference_content
 
-def batch_verify_citations_lightweight(citations_to_text, titles, model="glm-4-flash"):
-    """轻量级批量验证引用 - 使用元数据而非PDF"""
-    client = ZhipuAI(api_key=os.environ["ZHIPUAI_API_KEY"])
+def batch_verify_citations_lightweight(citations_to_text, titles, model="glm-4-flash", chunk_size=VERIFY_CHUNK_SIZE):
+    """轻量级批量验证引用 - 使用元数据而非PDF，每次请求合并验证chunk_size条引用"""
+    client = get_zhipu_client()
     verification_results = []
+    pending = []  # (结果下标, 引文, 参考文献信息)
+    
+    # 先并发获取所有被引文献的元数据(请求由search_from_arxiv统一限速)，使用默认的max_results以便与search_titles_from_arxiv共用缓存，只取前3条
+    cited_titles_all = dict.fromkeys(
+        titles[i-1] for citation, _ in citations_to_text for i in citation if 1 <= i <= len(titles)
+    )
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        metadata_futures = {
+            title: executor.submit(get_arxiv_metadata_only, title)
+            for title in cited_titles_all
+        }
+    
+    # 每个标题只选一次最佳匹配，多条引文共享同一篇文献时直接复用
+    title_to_meta = {}
+    for title, future in metadata_futures.items():
+        try:
+            metadata_results = future.result()[:3]
+            if metadata_results:
+                # 选择最相似的结果
+                best = process.extractOne(
+                    title.lower(), [metadata['title'].lower() for metadata in metadata_results],
+                    scorer=fuzz.ratio, processor=None, score_cutoff=60
+                )
+                
+                if best and best[1] > 60:
+                    best_similarity = best[1] / 100
+                    title_to_meta[title] = metadata_results[best[2]]
+                    # 简化日志输出
+                    print(f"  找到匹配: {title[:30]}... (相似度: {best_similarity:.2f})")
+                else:
+                    print(f"  未找到匹配: {title[:30]}...")
+            else:
+                print(f"  无搜索结果: {title[:30]}...")
+        except Exception as e:
+            print(f"  搜索出错: {title[:30]}... ({str(e)[:20]}...)")
     
     for citation, text in citations_to_text:
         # 获取引用文献的标题
@@ -332,31 +649,8 @@ def batch_verify_citations_lightweight(citations_to_text, titles, model="glm-4-f
             })
             continue
         
-        # 为每个引用的论文获取元数据
-        paper_metadata_list = []
-        for title in cited_titles:
-            try:
-                metadata_results = get_arxiv_metadata_only(title, max_results=3)
-                if metadata_results:
-                    # 选择最相似的结果
-                    best_match = None
-                    best_similarity = 0
-                    for metadata in metadata_results:
-                        similarity = SequenceMatcher(None, title.lower(), metadata['title'].lower()).ratio()
-                        if similarity > best_similarity and similarity > 0.6:
-                            best_similarity = similarity
-                            best_match = metadata
-                    
-                    if best_match:
-                        paper_metadata_list.append(best_match)
-                        # 简化日志输出
-                        print(f"  找到匹配: {title[:30]}... (相似度: {best_similarity:.2f})")
-                    else:
-                        print(f"  未找到匹配: {title[:30]}...")
-                else:
-                    print(f"  无搜索结果: {title[:30]}...")
-            except Exception as e:
-                print(f"  搜索出错: {title[:30]}... ({str(e)[:20]}...)")
+        # 为每个引用的论文取出已匹配的元数据
+        paper_metadata_list = [title_to_meta[title] for title in cited_titles if title in title_to_meta]
         
         if not paper_metadata_list:
             verification_results.append({
@@ -366,14 +660,44 @@ def batch_verify_citations_lightweight(citations_to_text, titles, model="glm-4-f
             })
             continue
         
-        # 使用元数据验证引用
-        try:
-            combined_reference = "\n\n".join([
-                verify_citation_with_metadata(text, metadata) 
-                for metadata in paper_metadata_list
-            ])
-            
-            prompt = f"""你是一个文献分析助手, 你的任务是:
+        combined_reference = "\n\n".join([
+            verify_citation_with_metadata(text, metadata) 
+            for metadata in paper_metadata_list
+        ])
+        verification_results.append({
+            'citation': citation,
+            'status': 'verified',
+            'metadata_count': len(paper_metadata_list)
+        })
+        pending.append((len(verification_results) - 1, text, combined_reference))
+    
+    # 分批发送给模型验证
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+        verdicts = _verify_citation_chunk(client, model, chunk)
+        if verdicts is None:
+            # 解析失败时重试一次
+            verdicts = _verify_citation_chunk(client, model, chunk) or {}
+        
+        for n, (index, text, combined_reference) in enumerate(chunk, 1):
+            result = verdicts.get(n)
+            if result is None:
+                # 批量结果缺失时退回单条验证
+                try:
+                    result = _verify_single_citation(client, model, text, combined_reference)
+                except Exception as e:
+                    verification_results[index] = {
+                        'citation': verification_results[index]['citation'],
+                        'status': 'error',
+                        'reason': str(e)
+                    }
+                    continue
+            verification_results[index]['result'] = result
+    
+    return verification_results
+
+def _verify_single_citation(client, model, text, combined_reference):
+    prompt = f"""你是一个文献分析助手, 你的任务是:
 分析引文段落是否与参考文献的标题、摘要内容相符.
 如果引文的内容与参考文献的主题、方法或结论相符, 请直接输出: <是>
 否则, 请以如下格式输出: <否: '在这里给出你的理由'>
@@ -383,36 +707,53 @@ def batch_verify_citations_lightweight(citations_to_text, titles, model="glm-4-f
 参考文献信息:
 {combined_reference}
 """
-            
-            response = client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0
-            )
-            
-            result = response.choices[0].message.content
-            
-            verification_results.append({
-                'citation': citation,
-                'status': 'verified',
-                'result': result,
-                'metadata_count': len(paper_metadata_list)
-            })
-            
-        except Exception as e:
-            verification_results.append({
-                'citation': citation,
-                'status': 'error',
-                'reason': str(e)
-            })
     
-    return verification_results
-
-
-
-
-
-
-
+    response = client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0
+    )
+    
+    return response.choices[0].message.content
 
+def _verify_citation_chunk(client, model, chunk):
+    """一次请求验证多条引文，返回{序号: '<是>'或'<否: 理由>'}，请求或解析失败时返回None"""
+    items = "\n\n".join(
+        f"### 引文 {n}\n文章的引文: {text}\n\n参考文献信息:\n{combined_reference}"
+        for n, (_, text, combined_reference) in enumerate(chunk, 1)
+    )
+    prompt = f"""你是一个文献分析助手, 你的任务是:
+逐条分析下列引文段落是否与对应参考文献的标题、摘要内容相符.
+如果引文的内容与参考文献的主题、方法或结论相符, verdict为"是", 否则verdict为"否"并在reason中用中文给出理由.
+请只输出一个JSON数组, 每条引文对应一个元素, 不要输出其他内容, 例如:
+[{{"id": 1, "verdict": "是", "reason": ""}}, {{"id": 2, "verdict": "否", "reason": "在这里给出你的理由"}}]
 
+{items}
+"""
+    
+    try:
+        response = client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0
+        )
+        parsed = _parse_json_array(response.choices[0].message.content)
+    except Exception as e:
+        logger.warning(f"批量验证请求失败: {str(e)[:50]}")
+        return None
+    if parsed is None:
+        logger.warning("批量验证结果解析失败")
+        return None
+    
+    verdicts = {}
+    for item in parsed:
+        try:
+            n = int(item['id'])
+        except (TypeError, KeyError, ValueError):
+            continue
+        verdict = str(item.get('verdict', '')).strip()
+        if verdict == '是':
+            verdicts[n] = '<是>'
+        elif verdict == '否':
+            verdicts[n] = f"<否: {item.get('reason', '')}>"
+    return verdicts